@@ -1,26 +1,58 @@
+import threading
+from contextlib import contextmanager
 from typing import Any, Dict, Iterable
 
 from neo4j import GraphDatabase, Transaction
 
 
 class Neo4jClient:
-    """Thin wrapper around the Neo4j driver to keep a consistent API."""
+    """Thin wrapper around the Neo4j driver to keep a consistent API.
+
+    Sessions are not thread-safe, so each worker thread gets its own
+    long-lived session (cached in a threading.local) instead of paying the
+    session open/close handshake on every write.
+    """
 
     def __init__(self, uri: str, user: str, password: str):
         self._driver = GraphDatabase.driver(uri, auth=(user, password))
+        self._local = threading.local()
 
     def close(self) -> None:
         self._driver.close()
 
+    def get_session(self):
+        """Return this thread's session, opening it on first use."""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._driver.session()
+            self._local.session = session
+        return session
+
+    @contextmanager
+    def transaction(self):
+        """Explicit transaction on the thread-local session: one BEGIN/COMMIT.
+
+        Unlike execute_write there is no automatic retry; failed batches go
+        back through the outbox attempts machinery instead.
+        """
+        with self.get_session().begin_transaction() as tx:
+            yield tx
+            tx.commit()
+
     def write(self, cypher: str, parameters: Dict[str, Any]) -> None:
-        with self._driver.session() as session:
-            session.execute_write(lambda tx: tx.run(cypher, **parameters))
+        self.get_session().execute_write(lambda tx: tx.run(cypher, **parameters))
 
     def write_transaction(self, fn, *args, **kwargs):
-        with self._driver.session() as session:
-            return session.execute_write(fn, *args, **kwargs)
+        return self.get_session().execute_write(fn, *args, **kwargs)
+
+    def run(self, cypher: str, parameters: Dict[str, Any]) -> None:
+        """Auto-commit query on the thread-local session.
+
+        Needed for procedures like apoc.periodic.iterate that manage their
+        own transactions and cannot run inside an explicit one.
+        """
+        self.get_session().run(cypher, **parameters).consume()
 
     def read(self, cypher: str, parameters: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
-        with self._driver.session() as session:
-            result = session.run(cypher, **parameters)
-            return [record.data() for record in result]
+        result = self.get_session().run(cypher, **parameters)
+        return [record.data() for record in result]
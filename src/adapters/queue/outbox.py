@@ -1,5 +1,6 @@
+import select
 from datetime import datetime
-from typing import Iterable, List, Optional
+from typing import Iterable, List, Optional, Tuple
 
 from psycopg2.extras import RealDictCursor
 
@@ -46,21 +47,65 @@ def fetch_pending_events(
     return [OutboxEvent(**row) for row in rows]
 
 
-def mark_processed(conn, event_id) -> None:
-    sql = "UPDATE outbox_events SET processed_at = NOW(), error_message = NULL WHERE id = %s;"
+def listen_for_events(conn, channel: str) -> None:
+    """Subscribe a dedicated autocommit connection to outbox NOTIFY wakeups.
+
+    The outbox-write side fires NOTIFY from an AFTER INSERT trigger on
+    outbox_events (see ops/README.md), so the worker wakes the moment new
+    work lands instead of waiting out its poll interval.
+    """
     with conn.cursor() as cur:
-        cur.execute(sql, (event_id,))
+        cur.execute(f"LISTEN {channel};")
+
+
+def wait_for_events(conn, timeout: float) -> bool:
+    """Block until a NOTIFY arrives on the listening connection or timeout elapses.
+
+    Returns True if at least one notification came in; all pending
+    notifications are drained since one fetch picks up a whole batch anyway.
+    The timeout keeps the old poll cadence as a safety net for notifications
+    sent while the worker was busy processing.
+    """
+    if not conn.notifies:
+        if not select.select([conn], [], [], timeout)[0]:
+            return False
+        conn.poll()
+    notified = bool(conn.notifies)
+    conn.notifies.clear()
+    return notified
+
+
+def mark_processed(conn, event_ids: List) -> None:
+    """Mark a batch of events processed in one statement."""
+    if not event_ids:
+        return
+    sql = "UPDATE outbox_events SET processed_at = NOW(), error_message = NULL WHERE id = ANY(%s);"
+    with conn.cursor() as cur:
+        cur.execute(sql, (list(event_ids),))
     conn.commit()
 
 
-def mark_failed(conn, event_id, error_message: str) -> None:
+def mark_failed(conn, failures: List[Tuple]) -> None:
+    """Record a batch of (event_id, error_message) failures in one statement.
+
+    The id array is cast explicitly to uuid (outbox_events.id) — an untyped
+    VALUES/array column would be coerced to text and the join against the
+    uuid column would fail, and a throw here would crash the worker loop
+    without ever incrementing attempts for the poison events.
+    """
+    if not failures:
+        return
     sql = """
-    UPDATE outbox_events
-    SET attempts = attempts + 1,
-        error_message = %s,
+    UPDATE outbox_events AS o
+    SET attempts = o.attempts + 1,
+        error_message = f.error_message,
         processed_at = NULL
-    WHERE id = %s;
+    FROM unnest(%s::uuid[], %s::text[]) AS f(id, error_message)
+    WHERE o.id = f.id;
     """
     with conn.cursor() as cur:
-        cur.execute(sql, (error_message[:1000], event_id))
+        cur.execute(sql, (
+            [str(event_id) for event_id, _ in failures],
+            [message[:1000] for _, message in failures],
+        ))
     conn.commit()
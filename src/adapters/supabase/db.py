@@ -1,22 +1,44 @@
 from contextlib import contextmanager
 from typing import Iterator, Optional
+from weakref import WeakKeyDictionary
 
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from psycopg2.pool import SimpleConnectionPool
+import psycopg2.errors
+from psycopg2.extras import NamedTupleCursor, RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
+
+# Statement names already PREPAREd, tracked per physical connection so each
+# pooled connection pays the parse/plan cost of a hot query only once.
+_PREPARED: "WeakKeyDictionary[psycopg2.extensions.connection, set]" = WeakKeyDictionary()
 
 
 class PostgresPool:
     """Minimal connection pool for Supabase Postgres (Gold layer)."""
 
-    def __init__(self, dsn: str, minconn: int = 1, maxconn: int = 5):
-        self._pool = SimpleConnectionPool(minconn, maxconn, dsn=dsn, cursor_factory=RealDictCursor)
+    def __init__(self, dsn: str, minconn: Optional[int] = None, maxconn: int = 5):
+        # ThreadedConnectionPool, not SimpleConnectionPool: the worker checks
+        # connections out from multiple threads, and the simple pool's
+        # getconn/putconn are unsynchronized. minconn defaults to maxconn so
+        # the pool stays warm — putconn closes returned connections above
+        # minconn, which would churn the physical connections (and their
+        # per-connection prepared-statement cache) under concurrency.
+        if minconn is None:
+            minconn = maxconn
+        self._pool = ThreadedConnectionPool(minconn, maxconn, dsn=dsn, cursor_factory=RealDictCursor)
 
     @contextmanager
     def connection(self) -> Iterator[psycopg2.extensions.connection]:
         conn = self._pool.getconn()
         try:
             yield conn
+            # Close the (possibly read-only) transaction cleanly: putconn
+            # rolls back anything left open, and Postgres discards statements
+            # PREPAREd inside a rolled-back transaction, which would defeat
+            # the per-connection prepared cache.
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
         finally:
             self._pool.putconn(conn)
 
@@ -40,3 +62,36 @@ def execute(conn, query: str, params: Optional[tuple] = None) -> None:
     with conn.cursor() as cur:
         cur.execute(query, params or ())
     conn.commit()
+
+
+def fetch_all_prepared(conn, name: str, query: str, params: tuple, cursor_factory=None):
+    """Run a server-side prepared statement, PREPAREing it once per connection.
+
+    `query` uses $1..$n placeholders. On the steady state each call is a bare
+    EXECUTE, so Postgres skips parse/plan entirely. If the server lost the
+    statement (e.g. the PREPARE was rolled back with a failed transaction),
+    it is re-issued once. Pass cursor_factory=NamedTupleCursor for tuple rows
+    with attribute access — cheaper than dict rows on wide scans.
+    """
+    names = _PREPARED.get(conn)
+    if names is None:
+        _PREPARED[conn] = names = set()
+
+    placeholders = ", ".join(["%s"] * len(params))
+    execute_sql = f"EXECUTE {name} ({placeholders})"
+    with conn.cursor(cursor_factory=cursor_factory) as cur:
+        if name not in names:
+            cur.execute(f"PREPARE {name} AS {query}")
+            names.add(name)
+        try:
+            cur.execute(execute_sql, params)
+        except psycopg2.errors.InvalidSqlStatementName:
+            # The rollback also discards any other statements PREPAREd in
+            # this (now aborted) transaction, so drop the whole cache for
+            # this connection, not just the missing name.
+            conn.rollback()
+            names.clear()
+            cur.execute(f"PREPARE {name} AS {query}")
+            names.add(name)
+            cur.execute(execute_sql, params)
+        return cur.fetchall()
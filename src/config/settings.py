@@ -14,6 +14,9 @@ class Settings(BaseSettings):
     poll_interval_seconds: int = Field(5, env="POLL_INTERVAL_SECONDS")
     batch_size: int = Field(100, env="BATCH_SIZE")
     max_attempts: int = Field(5, env="MAX_ATTEMPTS")
+    worker_concurrency: int = Field(4, env="WORKER_CONCURRENCY")
+    outbox_notify_channel: str = Field("outbox_new_event", env="OUTBOX_NOTIFY_CHANNEL")
+    neo4j_apoc_threshold: int = Field(5000, env="NEO4J_APOC_THRESHOLD")
 
     class Config:
         env_file = ".env"
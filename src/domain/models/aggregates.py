@@ -0,0 +1,70 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional
+
+
+def _iso(ts: Optional[datetime]) -> Optional[str]:
+    return ts.isoformat() if ts is not None else None
+
+
+@dataclass(slots=True)
+class RecipeAgg:
+    """Mutable per-recipe accumulator for the B2C aggregation loop.
+
+    slots=True keeps instances dict-free, so the hot loop mutates fixed
+    attribute slots instead of re-creating dicts per event. Converted to a
+    plain dict once, at wire time, via as_param().
+    """
+
+    recipe_id: str
+    views_count: int = 0
+    last_view_at: Optional[datetime] = None
+    cooks_count: int = 0
+    last_cook_at: Optional[datetime] = None
+    saved: bool = False
+    first_saved_at: Optional[datetime] = None
+    rating: Optional[float] = None
+    last_rating_at: Optional[datetime] = None
+
+    def as_param(self) -> Dict:
+        return {
+            "recipe_id": self.recipe_id,
+            "views_count": self.views_count,
+            "last_view_at": _iso(self.last_view_at),
+            "cooks_count": self.cooks_count,
+            "last_cook_at": _iso(self.last_cook_at),
+            "saved": self.saved,
+            "first_saved_at": _iso(self.first_saved_at),
+            "rating": self.rating,
+            "last_rating_at": _iso(self.last_rating_at),
+        }
+
+
+@dataclass(slots=True)
+class ProductAgg:
+    """Mutable per-product accumulator for the B2C aggregation loop."""
+
+    product_id: str
+    views_count: int = 0
+    last_view_at: Optional[datetime] = None
+    purchases_count: int = 0
+    last_purchase_at: Optional[datetime] = None
+    saved: bool = False
+    rating: Optional[float] = None
+    last_rating_at: Optional[datetime] = None
+    quantity_total: float = 0
+    price_total: float = 0
+
+    def as_param(self) -> Dict:
+        return {
+            "product_id": self.product_id,
+            "views_count": self.views_count,
+            "last_view_at": _iso(self.last_view_at),
+            "purchases_count": self.purchases_count,
+            "last_purchase_at": _iso(self.last_purchase_at),
+            "saved": self.saved,
+            "rating": self.rating,
+            "last_rating_at": _iso(self.last_rating_at),
+            "quantity_total": self.quantity_total,
+            "price_total": self.price_total,
+        }
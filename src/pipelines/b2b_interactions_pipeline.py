@@ -1,13 +1,90 @@
-from collections import defaultdict
-from typing import Dict, List, Optional
+import logging
+from datetime import date
+from typing import Dict, List, Optional, Tuple
 
 from src.adapters.neo4j.client import Neo4jClient
 from src.adapters.supabase import db as pg
 from src.config.settings import Settings
 from src.domain.models.events import OutboxEvent
+from src.utils.hashing import sync_hash
 from src.utils.logging import configure_logging
 
 
+log = configure_logging("b2b_interactions_pipeline")
+
+
+# ===================== CYPHER =====================
+# Constant query texts (one statement each) so Neo4j sees the same string
+# every batch and keeps hitting its plan cache; all four run in a single
+# transaction per batch.
+B2B_UPSERT_USERS_CYPHER = """
+    UNWIND $rows AS row
+    MERGE (u:VendorUser {id: row.user.id})
+    SET u.email = row.user.email,
+        u.role = row.user.role,
+        u.updated_at = datetime(row.user.updated_at)
+    MERGE (v:Vendor {id: row.user.vendor_id})
+    SET v.name = row.user.vendor_name
+    MERGE (u)-[:BELONGS_TO_VENDOR]->(v)
+    """
+
+B2B_DELETE_OLD_EDGES_CYPHER = """
+    UNWIND $rows AS row
+    MATCH (u:VendorUser {id: row.user.id})
+    WHERE u.sync_hash IS NULL OR u.sync_hash <> row.sync_hash
+    OPTIONAL MATCH (u)-[r:VIEWED_PRODUCT|APPROVED_MATCH|REJECTED_MATCH]->(:Product)
+    DELETE r
+    """
+
+B2B_UPSERT_PRODUCTS_CYPHER = """
+    UNWIND $rows AS row
+    MATCH (u:VendorUser {id: row.user.id})
+    WHERE u.sync_hash IS NULL OR u.sync_hash <> row.sync_hash
+    UNWIND row.products AS p
+      MERGE (prod:Product {id: p.product_id})
+      FOREACH (_ IN CASE WHEN p.views_count > 0 THEN [1] ELSE [] END |
+        MERGE (u)-[vp:VIEWED_PRODUCT]->(prod)
+        SET vp.count = p.views_count,
+            vp.last_at = datetime(p.last_view_at)
+      )
+    """
+
+B2B_UPSERT_MATCHES_CYPHER = """
+    UNWIND $rows AS row
+    MATCH (u:VendorUser {id: row.user.id})
+    WHERE u.sync_hash IS NULL OR u.sync_hash <> row.sync_hash
+    UNWIND row.matches AS m
+      MERGE (src:Product {id: m.source_product_id})
+      MERGE (tgt:Product {id: m.target_product_id})
+      FOREACH (_ IN CASE WHEN m.approved THEN [1] ELSE [] END |
+        MERGE (u)-[am:APPROVED_MATCH]->(tgt)
+        SET am.source_product_id = m.source_product_id,
+            am.last_at = datetime(m.last_feedback_at)
+      )
+      FOREACH (_ IN CASE WHEN m.rejected THEN [1] ELSE [] END |
+        MERGE (u)-[rm:REJECTED_MATCH]->(tgt)
+        SET rm.source_product_id = m.source_product_id,
+            rm.reason = m.reason,
+            rm.last_at = datetime(m.last_feedback_at)
+      )
+    """
+
+B2B_SET_SYNC_HASH_CYPHER = (
+    "UNWIND $rows AS row MATCH (u:VendorUser {id: row.user.id}) SET u.sync_hash = row.sync_hash"
+)
+
+B2B_DELETE_USERS_CYPHER = "UNWIND $ids AS uid MATCH (u:VendorUser {id: uid}) DETACH DELETE u"
+
+
+def _iso(ts: Optional[date]) -> Optional[str]:
+    """Render a timestamp as ISO-8601 once, at materialization time.
+
+    Cypher re-parses these with datetime(), and packing a short string is
+    cheaper for the driver than walking its temporal types row by row.
+    """
+    return ts.isoformat() if ts is not None else None
+
+
 class B2BInteractionsPipeline:
     """Aggregate B2B vendor user interactions into user→product/match edges."""
 
@@ -15,147 +92,141 @@ class B2BInteractionsPipeline:
         self.settings = settings
         self.pg_pool = pg_pool
         self.neo4j = neo4j
-        self.log = configure_logging("b2b_interactions_pipeline")
 
     # ===================== DATA LOADERS =====================
-    def load_vendor_user(self, conn, user_id: str) -> Optional[Dict]:
+    def load_vendor_users(self, conn, user_ids: List[str]) -> Dict[str, Dict]:
         sql = """
         SELECT vu.*, v.id AS vendor_id, v.name AS vendor_name
         FROM vendor_users vu
         JOIN vendors v ON v.id = vu.vendor_id
-        WHERE vu.id = %s;
+        WHERE vu.id = ANY($1);
         """
-        return pg.fetch_one(conn, sql, (user_id,))
-
-    def load_product_actions(self, conn, user_id: str) -> List[Dict]:
-        sql = """
-        SELECT product_id, action_type, created_at
-        FROM vendor_user_actions
-        WHERE vendor_user_id = %s AND product_id IS NOT NULL;
+        rows = pg.fetch_all_prepared(conn, "b2b_load_users", sql, (user_ids,))
+        # vu.* is forwarded wholesale to Neo4j, so stringify every timestamp
+        # column, not just updated_at.
+        for row in rows:
+            for key, value in row.items():
+                if isinstance(value, date):
+                    row[key] = value.isoformat()
+        return {row["id"]: row for row in rows}
+
+    def load_interactions(self, conn, user_ids: List[str]) -> Dict[str, Tuple[List[Dict], List[Dict]]]:
+        """Fetch pre-aggregated product and match stats for a batch of users in one round-trip.
+
+        Both tables are grouped server-side (GROUP BY + FILTER/bool_or), so
+        Postgres returns one row per distinct product or match pair instead
+        of one per raw action, and no Python aggregation pass is needed.
+        The two grouped queries are unioned into a single tagged result set
+        (superset of columns, NULL-padded) and demultiplexed client-side
+        into per-user (products, matches) lists.
         """
-        return pg.fetch_all(conn, sql, (user_id,))
-
-    def load_match_feedback(self, conn, user_id: str) -> List[Dict]:
         sql = """
-        SELECT source_product_id, target_product_id, feedback_type, reason, created_at
+        SELECT 'products' AS src, vendor_user_id AS uid, product_id, NULL AS target_product_id,
+               COUNT(*) FILTER (WHERE action_type = 'view_product') AS views_count,
+               MAX(created_at) FILTER (WHERE action_type = 'view_product') AS last_view_at,
+               NULL AS approved, NULL AS rejected, NULL AS reason, NULL AS last_feedback_at
+        FROM vendor_user_actions
+        WHERE vendor_user_id = ANY($1) AND product_id IS NOT NULL
+        GROUP BY vendor_user_id, product_id
+        UNION ALL
+        SELECT 'matches', vendor_user_id, source_product_id, target_product_id,
+               NULL, NULL,
+               bool_or(feedback_type = 'approved'),
+               bool_or(feedback_type = 'rejected'),
+               MAX(reason) FILTER (WHERE feedback_type = 'rejected'),
+               MAX(created_at)
         FROM match_feedback
-        WHERE vendor_user_id = %s;
+        WHERE vendor_user_id = ANY($1)
+        GROUP BY vendor_user_id, source_product_id, target_product_id;
         """
-        return pg.fetch_all(conn, sql, (user_id,))
-
-    # ===================== AGGREGATION =====================
-    def aggregate_products(self, actions: List[Dict]) -> List[Dict]:
-        agg = defaultdict(lambda: {"product_id": None, "views_count": 0, "last_view_at": None})
-        for row in actions:
-            pid = row["product_id"]
-            entry = agg[pid]
-            entry["product_id"] = pid
-            if row["action_type"] == "view_product":
-                entry["views_count"] += 1
-                ts = row["created_at"]
-                entry["last_view_at"] = max(entry["last_view_at"], ts) if entry["last_view_at"] else ts
-        return list(agg.values())
-
-    def aggregate_matches(self, feedback: List[Dict]) -> List[Dict]:
-        agg = defaultdict(lambda: {
-            "source_product_id": None,
-            "target_product_id": None,
-            "approved": False,
-            "rejected": False,
-            "reason": None,
-            "last_feedback_at": None,
-        })
-        for row in feedback:
-            key = (row["source_product_id"], row["target_product_id"])
-            entry = agg[key]
-            entry["source_product_id"] = row["source_product_id"]
-            entry["target_product_id"] = row["target_product_id"]
-            ts = row["created_at"]
-            entry["last_feedback_at"] = max(entry["last_feedback_at"], ts) if entry["last_feedback_at"] else ts
-            if row["feedback_type"] == "approved":
-                entry["approved"] = True
-            elif row["feedback_type"] == "rejected":
-                entry["rejected"] = True
-                entry["reason"] = row["reason"]
-        return list(agg.values())
-
-    # ===================== CYPHER =====================
-    def _upsert_cypher(self) -> str:
-        return """
-        MERGE (u:VendorUser {id: $user.id})
-        SET u.email = $user.email,
-            u.role = $user.role,
-            u.updated_at = datetime($user.updated_at)
-
-        MERGE (v:Vendor {id: $user.vendor_id})
-        SET v.name = $user.vendor_name
-
-        MERGE (u)-[:BELONGS_TO_VENDOR]->(v)
-
-        // Clear old product edges
-        WITH u
-        OPTIONAL MATCH (u)-[r:VIEWED_PRODUCT]->(:Product)
-        DELETE r;
-
-        // Rebuild product interactions
-        WITH u, $products AS products
-        UNWIND products AS p
-          MERGE (prod:Product {id: p.product_id})
-          FOREACH (_ IN CASE WHEN p.views_count > 0 THEN [1] ELSE [] END |
-            MERGE (u)-[vp:VIEWED_PRODUCT]->(prod)
-            SET vp.count = p.views_count,
-                vp.last_at = datetime(p.last_view_at)
-          );
-
-        // Clear old match feedback edges
-        WITH u
-        OPTIONAL MATCH (u)-[r:APPROVED_MATCH|REJECTED_MATCH]->(:Product)
-        DELETE r;
-
-        // Rebuild match feedback
-        WITH u, $matches AS matches
-        UNWIND matches AS m
-          MERGE (src:Product {id: m.source_product_id})
-          MERGE (tgt:Product {id: m.target_product_id})
-          FOREACH (_ IN CASE WHEN m.approved THEN [1] ELSE [] END |
-            MERGE (u)-[am:APPROVED_MATCH]->(tgt)
-            SET am.source_product_id = m.source_product_id,
-                am.last_at = datetime(m.last_feedback_at)
-          )
-          FOREACH (_ IN CASE WHEN m.rejected THEN [1] ELSE [] END |
-            MERGE (u)-[rm:REJECTED_MATCH]->(tgt)
-            SET rm.source_product_id = m.source_product_id,
-                rm.reason = m.reason,
-                rm.last_at = datetime(m.last_feedback_at)
-          );
-        """
-
-    def _delete_cypher(self) -> str:
-        return "MATCH (u:VendorUser {id: $id}) DETACH DELETE u;"
+        rows = pg.fetch_all_prepared(conn, "b2b_load_interactions", sql, (user_ids,), cursor_factory=pg.NamedTupleCursor)
+
+        by_user: Dict[str, Tuple[List[Dict], List[Dict]]] = {uid: ([], []) for uid in user_ids}
+        for row in rows:
+            products, matches = by_user[row.uid]
+            if row.src == "products":
+                products.append({
+                    "product_id": row.product_id,
+                    "views_count": row.views_count,
+                    "last_view_at": _iso(row.last_view_at),
+                })
+            else:
+                matches.append({
+                    "source_product_id": row.product_id,
+                    "target_product_id": row.target_product_id,
+                    "approved": row.approved,
+                    "rejected": row.rejected,
+                    "reason": row.reason,
+                    "last_feedback_at": _iso(row.last_feedback_at),
+                })
+        return by_user
 
     # ===================== OPERATIONS =====================
     def handle_event(self, event: OutboxEvent) -> None:
-        with self.pg_pool.connection() as conn:
-            user = self.load_vendor_user(conn, event.aggregate_id)
+        self.handle_events([event])
 
-        if user is None:
-            if event.op.upper() == "DELETE":
-                self.log.info("Deleting vendor user interactions", extra={"id": event.aggregate_id})
-                self.neo4j.write(self._delete_cypher(), {"id": event.aggregate_id})
-            else:
-                self.log.warning("Vendor user missing in Supabase; skipping", extra={"id": event.aggregate_id, "op": event.op})
-            return
+    def handle_events(self, events: List[OutboxEvent]) -> None:
+        """Process a batch of events with one Postgres fetch and one Neo4j write."""
+        # Last op wins per aggregate_id: events arrive in created_at order,
+        # and the final op plus the presence check below resolves every
+        # ordering correctly (e.g. UPDATE then DELETE must still delete).
+        ids_to_op = {}
+        for event in events:
+            ids_to_op[event.aggregate_id] = event.op
 
         with self.pg_pool.connection() as conn:
-            product_actions = self.load_product_actions(conn, event.aggregate_id)
-            match_feedback = self.load_match_feedback(conn, event.aggregate_id)
-
-        product_agg = self.aggregate_products(product_actions)
-        match_agg = self.aggregate_matches(match_feedback)
-
-        params = {"user": user, "products": product_agg, "matches": match_agg}
-        self.neo4j.write(self._upsert_cypher(), params)
-        self.log.info(
-            "Upserted B2B interactions",
-            extra={"id": event.aggregate_id, "products": len(product_agg), "matches": len(match_agg)},
-        )
+            users = self.load_vendor_users(conn, list(ids_to_op))
+            present = [uid for uid in ids_to_op if uid in users]
+            interactions = self.load_interactions(conn, present) if present else {}
+
+        delete_ids = []
+        for uid, op in ids_to_op.items():
+            if uid in users:
+                continue
+            if op.upper() == "DELETE":
+                delete_ids.append(uid)
+            else:
+                log.warning("Vendor user missing in Supabase; skipping", extra={"id": uid, "op": op})
+
+        rows = []
+        for uid in present:
+            products, matches = interactions[uid]
+            # Sorted by id so the payload (and therefore sync_hash) is stable
+            # regardless of the GROUP BY/UNION output order.
+            products.sort(key=lambda p: p["product_id"])
+            matches.sort(key=lambda m: (m["source_product_id"], m["target_product_id"]))
+            row = {"user": users[uid], "products": products, "matches": matches}
+            row["sync_hash"] = sync_hash(row)
+            rows.append(row)
+
+        if delete_ids:
+            if log.isEnabledFor(logging.INFO):
+                log.info("Deleting vendor user interactions", extra={"ids": delete_ids})
+            self.neo4j.write(B2B_DELETE_USERS_CYPHER, {"ids": delete_ids})
+
+        if rows:
+            with self.neo4j.transaction() as tx:
+                self._write_rows(tx, rows)
+            if log.isEnabledFor(logging.INFO):
+                log.info("Upserted B2B interactions", extra={"users": len(rows)})
+
+    def _write_rows(self, tx, rows: List[Dict]) -> None:
+        # Each statement ships only the fields it reads: the guard statements
+        # see just {user.id, sync_hash} and each upsert carries one aggregate
+        # list, so a batch's payload crosses the wire once, not once per
+        # statement.
+        slim = [{"user": {"id": row["user"]["id"]}, "sync_hash": row["sync_hash"]} for row in rows]
+
+        tx.run(B2B_UPSERT_USERS_CYPHER, rows=[{"user": row["user"]} for row in rows])
+        # The sync_hash guard turns delete/rebuild into no-ops for users whose
+        # aggregated payload is unchanged since the last sync. Rows with empty
+        # aggregates still pass through the cleanup (a user whose edges all
+        # disappeared must be wiped) but are dropped from the rebuild payloads.
+        tx.run(B2B_DELETE_OLD_EDGES_CYPHER, rows=slim)
+        product_rows = [{**s, "products": row["products"]} for s, row in zip(slim, rows) if row["products"]]
+        if product_rows:
+            tx.run(B2B_UPSERT_PRODUCTS_CYPHER, rows=product_rows)
+        match_rows = [{**s, "matches": row["matches"]} for s, row in zip(slim, rows) if row["matches"]]
+        if match_rows:
+            tx.run(B2B_UPSERT_MATCHES_CYPHER, rows=match_rows)
+        tx.run(B2B_SET_SYNC_HASH_CYPHER, rows=slim)
@@ -1,13 +1,248 @@
-from collections import defaultdict
-from typing import Dict, List, Optional
+import logging
+from datetime import date, datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+try:
+    import numba
+except ImportError:  # pragma: no cover
+    numba = None
 
 from src.adapters.neo4j.client import Neo4jClient
 from src.adapters.supabase import db as pg
 from src.config.settings import Settings
+from src.domain.models.aggregates import ProductAgg, RecipeAgg
 from src.domain.models.events import OutboxEvent
+from src.utils.hashing import sync_hash
 from src.utils.logging import configure_logging
 
 
+log = configure_logging("b2c_interactions_pipeline")
+
+
+# Source tags and subtype codes assigned by the UNION query (CASE WHEN ...),
+# so the aggregation loops dispatch on int equality instead of repeated
+# string comparisons. Keep these in sync with the SQL in load_interactions.
+SRC_HISTORY, SRC_SAVED, SRC_RATINGS, SRC_PRODUCTS = 1, 2, 3, 4
+HIST_VIEWED, HIST_COOKED = 1, 2
+PROD_VIEWED, PROD_PURCHASED, PROD_SAVED = 1, 2, 3
+
+
+def _iso(ts: Optional[date]) -> Optional[str]:
+    """Render a timestamp as ISO-8601 once, at materialization time.
+
+    Cypher re-parses these with datetime(), and packing a short string is
+    cheaper for the driver than walking its temporal types row by row.
+    """
+    return ts.isoformat() if ts is not None else None
+
+
+# Columnar fast path for the product aggregation. Interaction types arrive as
+# small int codes (PROD_*) from the SQL, product ids are factorized with
+# np.unique (so the kernel works on dense int indices instead of a typed dict
+# of UUID strings), and a JIT-compiled loop fills preallocated per-product
+# arrays. Below this row count the plain-Python loop wins because of
+# conversion and dispatch overhead.
+COLUMNAR_MIN_ROWS = 1000
+
+if numba is not None:
+
+    @numba.njit(cache=True)
+    def _agg_products_kernel(idx, codes, ts, rating, qty, price):  # pragma: no cover
+        n = idx.max() + 1 if idx.shape[0] else 0
+        views = np.zeros(n, np.int64)
+        last_view = np.full(n, -np.inf)
+        purchases = np.zeros(n, np.int64)
+        last_purchase = np.full(n, -np.inf)
+        saved = np.zeros(n, np.bool_)
+        rating_out = np.full(n, np.nan)
+        last_rating = np.full(n, -np.inf)
+        qty_total = np.zeros(n, np.float64)
+        price_total = np.zeros(n, np.float64)
+        for i in range(idx.shape[0]):
+            j = idx[i]
+            code = codes[i]
+            t = ts[i]
+            if code == 1:
+                views[j] += 1
+                if t > last_view[j]:
+                    last_view[j] = t
+            elif code == 2:
+                purchases[j] += 1
+                if t > last_purchase[j]:
+                    last_purchase[j] = t
+                qty_total[j] += qty[i]
+                price_total[j] += price[i]
+            elif code == 3:
+                saved[j] = True
+            r = rating[i]
+            if r == r and r != 0.0:  # truthy rating, NaN-safe
+                rating_out[j] = r
+                last_rating[j] = t
+        return views, last_view, purchases, last_purchase, saved, rating_out, last_rating, qty_total, price_total
+
+else:
+    _agg_products_kernel = None
+
+if np is not None:
+
+    def _agg_products_numpy(idx, codes, ts, rating, qty, price):
+        """Vectorized equivalent of the JIT kernel: bincount/maximum.at reductions.
+
+        Used for large inputs when numba is not installed; same contract as
+        _agg_products_kernel.
+        """
+        n = int(idx.max()) + 1 if idx.shape[0] else 0
+        viewed = codes == 1
+        purchased = codes == 2
+        views = np.bincount(idx[viewed], minlength=n).astype(np.int64)
+        last_view = np.full(n, -np.inf)
+        np.maximum.at(last_view, idx[viewed], ts[viewed])
+        purchases = np.bincount(idx[purchased], minlength=n).astype(np.int64)
+        last_purchase = np.full(n, -np.inf)
+        np.maximum.at(last_purchase, idx[purchased], ts[purchased])
+        qty_total = np.bincount(idx[purchased], weights=qty[purchased], minlength=n)
+        price_total = np.bincount(idx[purchased], weights=price[purchased], minlength=n)
+        saved = np.zeros(n, np.bool_)
+        saved[idx[codes == 3]] = True
+        # Fancy assignment keeps the last occurrence per index, matching the
+        # "latest truthy rating wins" behaviour of the row loop.
+        rated = ~np.isnan(rating) & (rating != 0.0)
+        rating_out = np.full(n, np.nan)
+        rating_out[idx[rated]] = rating[rated]
+        last_rating = np.full(n, -np.inf)
+        last_rating[idx[rated]] = ts[rated]
+        return views, last_view, purchases, last_purchase, saved, rating_out, last_rating, qty_total, price_total
+
+else:
+    _agg_products_numpy = None
+
+
+# ===================== CYPHER =====================
+# Constant query texts (one statement each) so Neo4j sees the same string
+# every batch and keeps hitting its plan cache; all four run in a single
+# transaction per batch.
+B2C_UPSERT_USERS_CYPHER = """
+    UNWIND $rows AS row
+    MERGE (u:B2CCustomer {id: row.user.id})
+    SET u.email = row.user.email,
+        u.full_name = row.user.full_name,
+        u.updated_at = datetime(row.user.updated_at)
+    """
+
+B2C_DELETE_OLD_EDGES_CYPHER = """
+    UNWIND $rows AS row
+    MATCH (u:B2CCustomer {id: row.user.id})
+    WHERE u.sync_hash IS NULL OR u.sync_hash <> row.sync_hash
+    OPTIONAL MATCH (u)-[r:VIEWED|COOKED|SAVED|RATED]->(:Recipe)
+    DELETE r
+    WITH DISTINCT u
+    OPTIONAL MATCH (u)-[pr:VIEWED_PRODUCT|PURCHASED|SAVED_PRODUCT|RATED_PRODUCT]->(:Product)
+    DELETE pr
+    """
+
+B2C_UPSERT_RECIPES_CYPHER = """
+    UNWIND $rows AS row
+    MATCH (u:B2CCustomer {id: row.user.id})
+    WHERE u.sync_hash IS NULL OR u.sync_hash <> row.sync_hash
+    UNWIND row.recipes AS i
+      MERGE (r:Recipe {id: i.recipe_id})
+      FOREACH (_ IN CASE WHEN i.views_count > 0 THEN [1] ELSE [] END |
+        MERGE (u)-[v:VIEWED]->(r)
+        SET v.count = i.views_count,
+            v.last_at = datetime(i.last_view_at)
+      )
+      FOREACH (_ IN CASE WHEN i.cooks_count > 0 THEN [1] ELSE [] END |
+        MERGE (u)-[c:COOKED]->(r)
+        SET c.count = i.cooks_count,
+            c.last_at = datetime(i.last_cook_at)
+      )
+      FOREACH (_ IN CASE WHEN i.saved THEN [1] ELSE [] END |
+        MERGE (u)-[s:SAVED]->(r)
+        SET s.first_saved_at = datetime(i.first_saved_at)
+      )
+      FOREACH (_ IN CASE WHEN i.rating IS NULL THEN [] ELSE [1] END |
+        MERGE (u)-[rr:RATED]->(r)
+        SET rr.rating = i.rating,
+            rr.last_at = datetime(i.last_rating_at)
+      )
+    """
+
+B2C_UPSERT_PRODUCTS_CYPHER = """
+    UNWIND $rows AS row
+    MATCH (u:B2CCustomer {id: row.user.id})
+    WHERE u.sync_hash IS NULL OR u.sync_hash <> row.sync_hash
+    UNWIND row.products AS p
+      MERGE (prod:Product {id: p.product_id})
+      FOREACH (_ IN CASE WHEN p.views_count > 0 THEN [1] ELSE [] END |
+        MERGE (u)-[vp:VIEWED_PRODUCT]->(prod)
+        SET vp.count = p.views_count,
+            vp.last_at = datetime(p.last_view_at)
+      )
+      FOREACH (_ IN CASE WHEN p.purchases_count > 0 THEN [1] ELSE [] END |
+        MERGE (u)-[pu:PURCHASED]->(prod)
+        SET pu.count = p.purchases_count,
+            pu.last_at = datetime(p.last_purchase_at),
+            pu.quantity_total = p.quantity_total,
+            pu.price_total = p.price_total
+      )
+      FOREACH (_ IN CASE WHEN p.saved THEN [1] ELSE [] END |
+        MERGE (u)-[sp:SAVED_PRODUCT]->(prod)
+      )
+      FOREACH (_ IN CASE WHEN p.rating IS NULL THEN [] ELSE [1] END |
+        MERGE (u)-[rp:RATED_PRODUCT]->(prod)
+        SET rp.rating = p.rating,
+            rp.last_at = datetime(p.last_rating_at)
+      )
+    """
+
+# Oversized product lists go through apoc.periodic.iterate so the server
+# commits in slices of 1000 instead of holding one giant transaction. Runs
+# on an auto-commit session (APOC manages its own transactions) and keeps
+# the same sync_hash guard and edge semantics as the UNWIND statement above.
+# parallel stays false: every edge MERGEs onto the same user node, so
+# parallel batches would just contend for its lock.
+B2C_UPSERT_PRODUCTS_APOC_CYPHER = """
+    CALL apoc.periodic.iterate(
+      "UNWIND $products AS p RETURN p",
+      "MATCH (u:B2CCustomer {id: $user_id})
+       WHERE u.sync_hash IS NULL OR u.sync_hash <> $sync_hash
+       MERGE (prod:Product {id: p.product_id})
+       FOREACH (_ IN CASE WHEN p.views_count > 0 THEN [1] ELSE [] END |
+         MERGE (u)-[vp:VIEWED_PRODUCT]->(prod)
+         SET vp.count = p.views_count,
+             vp.last_at = datetime(p.last_view_at)
+       )
+       FOREACH (_ IN CASE WHEN p.purchases_count > 0 THEN [1] ELSE [] END |
+         MERGE (u)-[pu:PURCHASED]->(prod)
+         SET pu.count = p.purchases_count,
+             pu.last_at = datetime(p.last_purchase_at),
+             pu.quantity_total = p.quantity_total,
+             pu.price_total = p.price_total
+       )
+       FOREACH (_ IN CASE WHEN p.saved THEN [1] ELSE [] END |
+         MERGE (u)-[sp:SAVED_PRODUCT]->(prod)
+       )
+       FOREACH (_ IN CASE WHEN p.rating IS NULL THEN [] ELSE [1] END |
+         MERGE (u)-[rp:RATED_PRODUCT]->(prod)
+         SET rp.rating = p.rating,
+             rp.last_at = datetime(p.last_rating_at)
+       )",
+      {batchSize: 1000, parallel: false,
+       params: {products: $products, user_id: $user_id, sync_hash: $sync_hash}})
+    """
+
+B2C_SET_SYNC_HASH_CYPHER = (
+    "UNWIND $rows AS row MATCH (u:B2CCustomer {id: row.user.id}) SET u.sync_hash = row.sync_hash"
+)
+
+B2C_DELETE_USERS_CYPHER = "UNWIND $ids AS uid MATCH (u:B2CCustomer {id: uid}) DETACH DELETE u"
+
+
 class B2CInteractionsPipeline:
     """Aggregate B2C recipe/product interactions into user→item edges."""
 
@@ -15,219 +250,273 @@ class B2CInteractionsPipeline:
         self.settings = settings
         self.pg_pool = pg_pool
         self.neo4j = neo4j
-        self.log = configure_logging("b2c_interactions_pipeline")
 
     # ===================== DATA LOADERS =====================
-    def load_user(self, conn, user_id: str) -> Optional[Dict]:
+    def load_users(self, conn, user_ids: List[str]) -> Dict[str, Dict]:
         sql = """
         SELECT id, email, full_name, updated_at
         FROM b2c_customers
-        WHERE id = %s;
+        WHERE id = ANY($1);
         """
-        return pg.fetch_one(conn, sql, (user_id,))
+        rows = pg.fetch_all_prepared(conn, "b2c_load_users", sql, (user_ids,))
+        for row in rows:
+            row["updated_at"] = _iso(row["updated_at"])
+        return {row["id"]: row for row in rows}
 
-    def load_recipe_history(self, conn, user_id: str) -> List[Dict]:
-        sql = """
-        SELECT recipe_id, event_type, event_at
-        FROM recipe_history
-        WHERE user_id = %s;
-        """
-        return pg.fetch_all(conn, sql, (user_id,))
+    def load_interactions(self, conn, user_ids: List[str]) -> Dict[str, Tuple[List[tuple], List[tuple]]]:
+        """Fetch history, saved recipes, ratings and product interactions for a batch of users in one round-trip.
 
-    def load_saved_recipes(self, conn, user_id: str) -> List[Dict]:
-        sql = """
-        SELECT recipe_id, saved_at
-        FROM saved_recipes
-        WHERE user_id = %s;
+        The four per-table queries are unioned into a single tagged result set
+        (superset of columns, NULL-padded) and demultiplexed client-side into
+        per-user (recipes, products) lists, so a whole batch costs one query
+        instead of four per user. The three recipe sources stay interleaved in
+        one tagged list — aggregate_recipes dispatches on the src tag in a
+        single pass, so each recipe's dict entry is looked up once instead of
+        once per source table. Rows come back as namedtuples and are
+        partitioned as-is; the aggregation loops read the shared column names
+        (item_id, subtype, ts, ...) by attribute, which skips both the
+        per-row dict rebuild and per-field string hashing.
         """
-        return pg.fetch_all(conn, sql, (user_id,))
-
-    def load_recipe_ratings(self, conn, user_id: str) -> List[Dict]:
         sql = """
-        SELECT recipe_id, rating, created_at
+        SELECT 1 AS src, user_id AS uid, recipe_id AS item_id,
+               CASE event_type WHEN 'viewed' THEN 1 WHEN 'cooked' THEN 2 ELSE 0 END AS subtype,
+               event_at AS ts, NULL AS rating, NULL AS quantity, NULL AS price_paid
+        FROM recipe_history
+        WHERE user_id = ANY($1)
+        UNION ALL
+        SELECT 2, user_id, recipe_id, 0, saved_at, NULL, NULL, NULL
+        FROM saved_recipes
+        WHERE user_id = ANY($1)
+        UNION ALL
+        SELECT 3, b2c_customer_id, recipe_id, 0, created_at, rating, NULL, NULL
         FROM recipe_ratings
-        WHERE b2c_customer_id = %s;
-        """
-        return pg.fetch_all(conn, sql, (user_id,))
-
-    def load_product_interactions(self, conn, user_id: str) -> List[Dict]:
-        sql = """
-        SELECT product_id, interaction_type, rating, quantity, price_paid, interaction_timestamp
+        WHERE b2c_customer_id = ANY($1)
+        UNION ALL
+        SELECT 4, b2c_customer_id, product_id,
+               CASE interaction_type WHEN 'viewed' THEN 1 WHEN 'purchased' THEN 2 WHEN 'saved' THEN 3 ELSE 0 END,
+               interaction_timestamp, rating, quantity, price_paid
         FROM customer_product_interactions
-        WHERE b2c_customer_id = %s;
+        WHERE b2c_customer_id = ANY($1);
         """
-        return pg.fetch_all(conn, sql, (user_id,))
+        rows = pg.fetch_all_prepared(conn, "b2c_load_interactions", sql, (user_ids,), cursor_factory=pg.NamedTupleCursor)
+
+        by_user: Dict[str, Tuple[List[tuple], List[tuple]]] = {uid: ([], []) for uid in user_ids}
+        for row in rows:
+            recipes, products = by_user[row.uid]
+            if row.src == SRC_PRODUCTS:
+                products.append(row)
+            else:
+                recipes.append(row)
+        return by_user
 
     # ===================== AGGREGATION =====================
-    def aggregate_recipes(self, history: List[Dict], saved: List[Dict], ratings: List[Dict]) -> List[Dict]:
-        agg = defaultdict(lambda: {
-            "recipe_id": None,
-            "views_count": 0,
-            "last_view_at": None,
-            "cooks_count": 0,
-            "last_cook_at": None,
-            "saved": False,
-            "first_saved_at": None,
-            "rating": None,
-            "last_rating_at": None,
-        })
-        for row in history:
-            rid = row["recipe_id"]
-            entry = agg[rid]
-            entry["recipe_id"] = rid
-            if row["event_type"] == "viewed":
-                entry["views_count"] += 1
-                entry["last_view_at"] = max(entry["last_view_at"], row["event_at"]) if entry["last_view_at"] else row["event_at"]
-            elif row["event_type"] == "cooked":
-                entry["cooks_count"] += 1
-                entry["last_cook_at"] = max(entry["last_cook_at"], row["event_at"]) if entry["last_cook_at"] else row["event_at"]
-
-        for row in saved:
-            rid = row["recipe_id"]
-            entry = agg[rid]
-            entry["recipe_id"] = rid
-            entry["saved"] = True
-            entry["first_saved_at"] = min(entry["first_saved_at"], row["saved_at"]) if entry["first_saved_at"] else row["saved_at"]
-
-        for row in ratings:
-            rid = row["recipe_id"]
-            entry = agg[rid]
-            entry["recipe_id"] = rid
-            entry["rating"] = row["rating"]
-            entry["last_rating_at"] = row["created_at"]
-
-        return list(agg.values())
-
-    def aggregate_products(self, interactions: List[Dict]) -> List[Dict]:
-        agg = defaultdict(lambda: {
-            "product_id": None,
-            "views_count": 0,
-            "last_view_at": None,
-            "purchases_count": 0,
-            "last_purchase_at": None,
-            "saved": False,
-            "rating": None,
-            "last_rating_at": None,
-            "quantity_total": 0,
-            "price_total": 0,
-        })
-        for row in interactions:
-            pid = row["product_id"]
-            entry = agg[pid]
-            entry["product_id"] = pid
-            itype = row["interaction_type"]
-            ts = row["interaction_timestamp"]
-            if itype == "viewed":
-                entry["views_count"] += 1
-                entry["last_view_at"] = max(entry["last_view_at"], ts) if entry["last_view_at"] else ts
-            elif itype == "purchased":
-                entry["purchases_count"] += 1
-                entry["last_purchase_at"] = max(entry["last_purchase_at"], ts) if entry["last_purchase_at"] else ts
-                entry["quantity_total"] += row.get("quantity") or 0
-                entry["price_total"] += row.get("price_paid") or 0
-            elif itype == "saved":
-                entry["saved"] = True
-            if row.get("rating"):
-                entry["rating"] = row["rating"]
-                entry["last_rating_at"] = ts
-        return list(agg.values())
-
-    # ===================== CYPHER =====================
-    def _upsert_cypher(self) -> str:
-        return """
-        MERGE (u:B2CCustomer {id: $user.id})
-        SET u.email = $user.email,
-            u.full_name = $user.full_name,
-            u.updated_at = datetime($user.updated_at)
-
-        // Clear old recipe edges
-        WITH u
-        OPTIONAL MATCH (u)-[r:VIEWED|COOKED|SAVED|RATED]->(:Recipe)
-        DELETE r;
-
-        // Rebuild recipe interactions
-        WITH u, $recipes AS recipes
-        UNWIND recipes AS i
-          MERGE (r:Recipe {id: i.recipe_id})
-          FOREACH (_ IN CASE WHEN i.views_count > 0 THEN [1] ELSE [] END |
-            MERGE (u)-[v:VIEWED]->(r)
-            SET v.count = i.views_count,
-                v.last_at = datetime(i.last_view_at)
-          )
-          FOREACH (_ IN CASE WHEN i.cooks_count > 0 THEN [1] ELSE [] END |
-            MERGE (u)-[c:COOKED]->(r)
-            SET c.count = i.cooks_count,
-                c.last_at = datetime(i.last_cook_at)
-          )
-          FOREACH (_ IN CASE WHEN i.saved THEN [1] ELSE [] END |
-            MERGE (u)-[s:SAVED]->(r)
-            SET s.first_saved_at = datetime(i.first_saved_at)
-          )
-          FOREACH (_ IN CASE WHEN i.rating IS NULL THEN [] ELSE [1] END |
-            MERGE (u)-[rr:RATED]->(r)
-            SET rr.rating = i.rating,
-                rr.last_at = datetime(i.last_rating_at)
-          );
-
-        // Clear old product edges
-        WITH u
-        OPTIONAL MATCH (u)-[pr:VIEWED_PRODUCT|PURCHASED|SAVED_PRODUCT|RATED_PRODUCT]->(:Product)
-        DELETE pr;
-
-        // Rebuild product interactions
-        WITH u, $products AS products
-        UNWIND products AS p
-          MERGE (prod:Product {id: p.product_id})
-          FOREACH (_ IN CASE WHEN p.views_count > 0 THEN [1] ELSE [] END |
-            MERGE (u)-[vp:VIEWED_PRODUCT]->(prod)
-            SET vp.count = p.views_count,
-                vp.last_at = datetime(p.last_view_at)
-          )
-          FOREACH (_ IN CASE WHEN p.purchases_count > 0 THEN [1] ELSE [] END |
-            MERGE (u)-[pu:PURCHASED]->(prod)
-            SET pu.count = p.purchases_count,
-                pu.last_at = datetime(p.last_purchase_at),
-                pu.quantity_total = p.quantity_total,
-                pu.price_total = p.price_total
-          )
-          FOREACH (_ IN CASE WHEN p.saved THEN [1] ELSE [] END |
-            MERGE (u)-[sp:SAVED_PRODUCT]->(prod)
-          )
-          FOREACH (_ IN CASE WHEN p.rating IS NULL THEN [] ELSE [1] END |
-            MERGE (u)-[rp:RATED_PRODUCT]->(prod)
-            SET rp.rating = p.rating,
-                rp.last_at = datetime(p.last_rating_at)
-          );
+    def aggregate_recipes(self, rows: List[tuple]) -> List[Dict]:
+        """Single pass over the tagged recipe stream, dispatching on src.
+
+        History, saved and ratings rows arrive interleaved from the UNION
+        query, so each recipe's entry is created and looked up once rather
+        than once per source table. Entries are slotted RecipeAgg accumulators
+        mutated in place and converted to plain dicts once, at wire time.
         """
+        agg: Dict[str, RecipeAgg] = {}
+        for row in rows:
+            rid = row.item_id
+            entry = agg.get(rid)
+            if entry is None:
+                agg[rid] = entry = RecipeAgg(rid)
+            src = row.src
+            ts = row.ts
+            if src == SRC_HISTORY:
+                if row.subtype == HIST_VIEWED:
+                    entry.views_count += 1
+                    last = entry.last_view_at
+                    entry.last_view_at = ts if last is None or ts > last else last
+                elif row.subtype == HIST_COOKED:
+                    entry.cooks_count += 1
+                    last = entry.last_cook_at
+                    entry.last_cook_at = ts if last is None or ts > last else last
+            elif src == SRC_SAVED:
+                entry.saved = True
+                first = entry.first_saved_at
+                entry.first_saved_at = ts if first is None or ts < first else first
+            else:  # SRC_RATINGS
+                entry.rating = row.rating
+                entry.last_rating_at = ts
+
+        # Sorted by id so the payload (and therefore sync_hash) is stable
+        # regardless of the UNION's arrival order.
+        return [agg[rid].as_param() for rid in sorted(agg)]
 
-    def _delete_cypher(self) -> str:
-        return "MATCH (u:B2CCustomer {id: $id}) DETACH DELETE u;"
+    def aggregate_products(self, interactions: List[tuple]) -> List[Dict]:
+        if np is not None and len(interactions) >= COLUMNAR_MIN_ROWS:
+            return self._aggregate_products_columnar(interactions)
+        agg: Dict[str, ProductAgg] = {}
+        for row in interactions:
+            pid = row.item_id
+            entry = agg.get(pid)
+            if entry is None:
+                agg[pid] = entry = ProductAgg(pid)
+            code = row.subtype
+            ts = row.ts
+            if code == PROD_VIEWED:
+                entry.views_count += 1
+                last = entry.last_view_at
+                entry.last_view_at = ts if last is None or ts > last else last
+            elif code == PROD_PURCHASED:
+                entry.purchases_count += 1
+                last = entry.last_purchase_at
+                entry.last_purchase_at = ts if last is None or ts > last else last
+                entry.quantity_total += row.quantity or 0
+                entry.price_total += row.price_paid or 0
+            elif code == PROD_SAVED:
+                entry.saved = True
+            if row.rating:
+                entry.rating = row.rating
+                entry.last_rating_at = ts
+        # Sorted by id for a stable sync_hash; the columnar path gets the
+        # same order for free from np.unique.
+        return [agg[pid].as_param() for pid in sorted(agg)]
+
+    def _aggregate_products_columnar(self, interactions: List[tuple]) -> List[Dict]:
+        count = len(interactions)
+        pids = np.array([row.item_id for row in interactions])
+        codes = np.fromiter((row.subtype for row in interactions), dtype=np.int8, count=count)
+        ts = np.fromiter(
+            (row.ts.timestamp() for row in interactions),
+            dtype=np.float64, count=count,
+        )
+        rating = np.fromiter(
+            (float(row.rating) if row.rating else np.nan for row in interactions),
+            dtype=np.float64, count=count,
+        )
+        qty = np.fromiter((float(row.quantity or 0) for row in interactions), dtype=np.float64, count=count)
+        price = np.fromiter((float(row.price_paid or 0) for row in interactions), dtype=np.float64, count=count)
+
+        uniq, inverse = np.unique(pids, return_inverse=True)
+        kernel = _agg_products_kernel if _agg_products_kernel is not None else _agg_products_numpy
+        views, last_view, purchases, last_purchase, saved, rating_out, last_rating, qty_total, price_total = (
+            kernel(inverse, codes, ts, rating, qty, price)
+        )
+
+        # Timestamps round-trip through epoch seconds and come back as UTC.
+        def from_epoch(sec: float) -> Optional[str]:
+            return None if sec == -np.inf else datetime.fromtimestamp(sec, tz=timezone.utc).isoformat()
+
+        return [
+            {
+                "product_id": pid,
+                "views_count": int(views[k]),
+                "last_view_at": from_epoch(last_view[k]),
+                "purchases_count": int(purchases[k]),
+                "last_purchase_at": from_epoch(last_purchase[k]),
+                "saved": bool(saved[k]),
+                "rating": None if rating_out[k] != rating_out[k] else rating_out[k],
+                "last_rating_at": from_epoch(last_rating[k]),
+                "quantity_total": qty_total[k],
+                "price_total": price_total[k],
+            }
+            for k, pid in enumerate(uniq.tolist())
+        ]
 
     # ===================== OPERATIONS =====================
     def handle_event(self, event: OutboxEvent) -> None:
+        self.handle_events([event])
+
+    def handle_events(self, events: List[OutboxEvent]) -> None:
+        """Process a batch of events with one Postgres fetch and one Neo4j write."""
+        # Last op wins per aggregate_id: events arrive in created_at order,
+        # and the final op plus the presence check below resolves every
+        # ordering correctly (e.g. UPDATE then DELETE must still delete).
+        ids_to_op = {}
+        for event in events:
+            ids_to_op[event.aggregate_id] = event.op
+
         with self.pg_pool.connection() as conn:
-            user = self.load_user(conn, event.aggregate_id)
+            users = self.load_users(conn, list(ids_to_op))
+            present = [uid for uid in ids_to_op if uid in users]
+            interactions = self.load_interactions(conn, present) if present else {}
 
-        if user is None:
-            if event.op.upper() == "DELETE":
-                self.log.info("Deleting B2C user interactions", extra={"id": event.aggregate_id})
-                self.neo4j.write(self._delete_cypher(), {"id": event.aggregate_id})
+        delete_ids = []
+        for uid, op in ids_to_op.items():
+            if uid in users:
+                continue
+            if op.upper() == "DELETE":
+                delete_ids.append(uid)
             else:
-                self.log.warning("B2C user missing in Supabase; skipping", extra={"id": event.aggregate_id, "op": event.op})
-            return
+                log.warning("B2C user missing in Supabase; skipping", extra={"id": uid, "op": op})
 
-        with self.pg_pool.connection() as conn:
-            history = self.load_recipe_history(conn, event.aggregate_id)
-            saved = self.load_saved_recipes(conn, event.aggregate_id)
-            ratings = self.load_recipe_ratings(conn, event.aggregate_id)
-            prod_interactions = self.load_product_interactions(conn, event.aggregate_id)
-
-        recipe_agg = self.aggregate_recipes(history, saved, ratings)
-        product_agg = self.aggregate_products(prod_interactions)
-
-        params = {"user": user, "recipes": recipe_agg, "products": product_agg}
-        self.neo4j.write(self._upsert_cypher(), params)
-        self.log.info(
-            "Upserted B2C interactions",
-            extra={"id": event.aggregate_id, "recipes": len(recipe_agg), "products": len(product_agg)},
-        )
+        rows = []
+        for uid in present:
+            recipe_rows, prod_interactions = interactions[uid]
+            row = {
+                "user": users[uid],
+                "recipes": self.aggregate_recipes(recipe_rows),
+                "products": self.aggregate_products(prod_interactions),
+            }
+            row["sync_hash"] = sync_hash(row)
+            rows.append(row)
+
+        if delete_ids:
+            if log.isEnabledFor(logging.INFO):
+                log.info("Deleting B2C user interactions", extra={"ids": delete_ids})
+            self.neo4j.write(B2C_DELETE_USERS_CYPHER, {"ids": delete_ids})
+
+        if rows:
+            with self.neo4j.transaction() as tx:
+                apoc_rows = self._write_rows(tx, rows)
+            # Oversized product lists are rebuilt after the batch commits:
+            # apoc.periodic.iterate runs its own transactions server-side and
+            # cannot sit inside an explicit one. The sync_hash for these rows
+            # is only set once their rebuild succeeds, so a crash in between
+            # leaves the hash stale and the next attempt redoes the work.
+            for row in apoc_rows:
+                self.neo4j.run(B2C_UPSERT_PRODUCTS_APOC_CYPHER, {
+                    "user_id": row["user"]["id"],
+                    "sync_hash": row["sync_hash"],
+                    "products": row["products"],
+                })
+                # Slim row: don't re-ship the oversized products list just to
+                # read the id and hash on the server.
+                self.neo4j.run(B2C_SET_SYNC_HASH_CYPHER, {
+                    "rows": [{"user": {"id": row["user"]["id"]}, "sync_hash": row["sync_hash"]}],
+                })
+            if log.isEnabledFor(logging.INFO):
+                log.info("Upserted B2C interactions", extra={"users": len(rows)})
+
+    def _write_rows(self, tx, rows: List[Dict]) -> List[Dict]:
+        """Run the batch statements; returns rows whose product rebuild is deferred to APOC.
+
+        Deferred rows are excluded from both the in-transaction product upsert
+        and the sync_hash update — the caller sets their hash after the APOC
+        rebuild lands.
+        """
+        threshold = self.settings.neo4j_apoc_threshold
+        apoc_rows = [row for row in rows if len(row["products"]) > threshold]
+        deferred = {id(row) for row in apoc_rows}
+
+        # Each statement ships only the fields it reads: the guard statements
+        # see just {user.id, sync_hash} and each upsert carries one aggregate
+        # list, so a batch's payload crosses the wire once, not once per
+        # statement.
+        slim = [{"user": {"id": row["user"]["id"]}, "sync_hash": row["sync_hash"]} for row in rows]
+
+        tx.run(B2C_UPSERT_USERS_CYPHER, rows=[{"user": row["user"]} for row in rows])
+        # The sync_hash guard turns delete/rebuild into no-ops for users whose
+        # aggregated payload is unchanged since the last sync. Rows with empty
+        # aggregates still pass through the cleanup (a user whose edges all
+        # disappeared must be wiped) but are dropped from the rebuild payloads.
+        tx.run(B2C_DELETE_OLD_EDGES_CYPHER, rows=slim)
+        recipe_rows = [{**s, "recipes": row["recipes"]} for s, row in zip(slim, rows) if row["recipes"]]
+        if recipe_rows:
+            tx.run(B2C_UPSERT_RECIPES_CYPHER, rows=recipe_rows)
+        product_rows = [
+            {**s, "products": row["products"]}
+            for s, row in zip(slim, rows)
+            if row["products"] and id(row) not in deferred
+        ]
+        if product_rows:
+            tx.run(B2C_UPSERT_PRODUCTS_CYPHER, rows=product_rows)
+        hash_rows = [s for s, row in zip(slim, rows) if id(row) not in deferred]
+        if hash_rows:
+            tx.run(B2C_SET_SYNC_HASH_CYPHER, rows=hash_rows)
+        return apoc_rows
@@ -0,0 +1,13 @@
+import hashlib
+import json
+from typing import Any
+
+
+def sync_hash(payload: Any) -> str:
+    """Stable 128-bit digest of a JSON-serializable payload.
+
+    Non-JSON types (datetimes, Decimals) are stringified, and keys are
+    sorted, so the same aggregated state always hashes to the same value.
+    """
+    data = json.dumps(payload, sort_keys=True, default=str).encode()
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
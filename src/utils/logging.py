@@ -1,7 +1,9 @@
 import logging
 import sys
+from functools import lru_cache
 
 
+@lru_cache(maxsize=None)
 def configure_logging(name: str) -> logging.Logger:
     """Simple JSON-ish logger to keep output structured for workers."""
     logger = logging.getLogger(name)
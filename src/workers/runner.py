@@ -1,8 +1,16 @@
-import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
+import psycopg2
+
 from src.adapters.neo4j.client import Neo4jClient
-from src.adapters.queue.outbox import fetch_pending_events, mark_failed, mark_processed
+from src.adapters.queue.outbox import (
+    fetch_pending_events,
+    listen_for_events,
+    mark_failed,
+    mark_processed,
+    wait_for_events,
+)
 from src.adapters.supabase.db import PostgresPool
 from src.config.settings import Settings
 from src.domain.models.events import OutboxEvent
@@ -24,24 +32,69 @@ TABLES = [
 AGG_TYPES = ["b2c_interaction", "b2b_interaction"]
 
 
-def process_batch(b2c_pipeline, b2b_pipeline, events: List[OutboxEvent], pg_pool: PostgresPool, log):
-    for event in events:
-        try:
-            agg = event.aggregate_type
-            if agg == "b2c_interaction":
-                b2c_pipeline.handle_event(event)
-            elif agg == "b2b_interaction":
-                b2b_pipeline.handle_event(event)
+def _process_chunk(pipeline, chunk: List[OutboxEvent], pg_pool: PostgresPool, log):
+    """Handle one chunk of events and record the outcome; never raises.
+
+    Marking processed/failed happens here, inside the worker, so a slow or
+    failing chunk cannot stall bookkeeping for the rest of the batch. When
+    the batched path fails, the chunk's events are retried one by one so a
+    single poison event doesn't burn attempts for everything deterministically
+    co-chunked with it — only the events that actually fail are marked failed.
+    """
+    try:
+        pipeline.handle_events(chunk)
+    except Exception:  # noqa: BLE001
+        log.exception("Failed processing interaction batch; retrying events individually",
+                      extra={"event_ids": [e.id for e in chunk]})
+        processed, failures = [], []
+        for event in chunk:
+            try:
+                pipeline.handle_event(event)
+            except Exception as exc:  # noqa: BLE001
+                log.exception("Failed processing interaction event", extra={"event_id": event.id})
+                failures.append((event.id, str(exc)))
             else:
-                log.warning("Unhandled aggregate type", extra={"aggregate_type": agg, "event_id": event.id})
-                continue
+                processed.append(event.id)
+        with pg_pool.connection() as conn:
+            mark_processed(conn, processed)
+            mark_failed(conn, failures)
+    else:
+        with pg_pool.connection() as conn:
+            mark_processed(conn, [event.id for event in chunk])
 
-            with pg_pool.connection() as conn:
-                mark_processed(conn, event.id)
-        except Exception as exc:  # noqa: BLE001
-            log.exception("Failed processing interaction event", extra={"event_id": event.id, "aggregate_id": event.aggregate_id})
-            with pg_pool.connection() as conn:
-                mark_failed(conn, event.id, str(exc))
+
+def process_batch(b2c_pipeline, b2b_pipeline, events: List[OutboxEvent], pg_pool: PostgresPool, log, concurrency: int = 1, executor: ThreadPoolExecutor = None):
+    groups = {"b2c_interaction": [], "b2b_interaction": []}
+    for event in events:
+        group = groups.get(event.aggregate_type)
+        if group is None:
+            log.warning("Unhandled aggregate type", extra={"aggregate_type": event.aggregate_type, "event_id": event.id})
+            continue
+        group.append(event)
+
+    # Partition each group by aggregate_id hash so every event for a given
+    # user lands in the same chunk: two threads must never delete/rebuild the
+    # same user node concurrently (lock contention, and the older snapshot
+    # could commit last). Within a bucket, created_at order is preserved;
+    # each chunk is still one Neo4j write.
+    chunks = []
+    n_buckets = max(concurrency, 1)
+    for pipeline, group in ((b2c_pipeline, groups["b2c_interaction"]), (b2b_pipeline, groups["b2b_interaction"])):
+        if not group:
+            continue
+        buckets = {}
+        for event in group:
+            buckets.setdefault(hash(event.aggregate_id) % n_buckets, []).append(event)
+        chunks.extend((pipeline, bucket) for bucket in buckets.values())
+
+    if executor is None or concurrency <= 1 or len(chunks) <= 1:
+        for pipeline, chunk in chunks:
+            _process_chunk(pipeline, chunk, pg_pool, log)
+        return
+
+    futures = [executor.submit(_process_chunk, pipeline, chunk, pg_pool, log) for pipeline, chunk in chunks]
+    for future in futures:
+        future.result()
 
 
 def main():
@@ -49,12 +102,24 @@ def main():
     log = configure_logging("feedback_interactions_worker")
     log.info("Starting feedback/interactions worker", extra={"pipeline": settings.pipeline_name})
 
-    pg_pool = PostgresPool(settings.supabase_dsn)
+    # One connection per worker thread plus one for the main loop's fetch;
+    # getconn raises rather than blocks when the pool is exhausted.
+    pg_pool = PostgresPool(settings.supabase_dsn, maxconn=settings.worker_concurrency + 1)
     neo4j = Neo4jClient(settings.neo4j_uri, settings.neo4j_user, settings.neo4j_password)
 
     b2c_pipeline = B2CInteractionsPipeline(settings, pg_pool, neo4j)
     b2b_pipeline = B2BInteractionsPipeline(settings, pg_pool, neo4j)
 
+    # One long-lived pool for the process: the worker threads persist across
+    # batches, so their thread-local Neo4j sessions stay open too.
+    executor = ThreadPoolExecutor(max_workers=settings.worker_concurrency) if settings.worker_concurrency > 1 else None
+
+    # Dedicated non-pooled connection for LISTEN: it blocks on the socket
+    # between batches and must never be handed out for queries.
+    listen_conn = psycopg2.connect(settings.supabase_dsn)
+    listen_conn.autocommit = True
+    listen_for_events(listen_conn, settings.outbox_notify_channel)
+
     try:
         while True:
             with pg_pool.connection() as conn:
@@ -69,11 +134,16 @@ def main():
                 conn.commit()
 
             if not events:
-                time.sleep(settings.poll_interval_seconds)
+                # Sleep on the NOTIFY socket instead of a fixed poll cadence;
+                # the timeout keeps the old interval as a missed-wakeup net.
+                wait_for_events(listen_conn, settings.poll_interval_seconds)
                 continue
 
-            process_batch(b2c_pipeline, b2b_pipeline, events, pg_pool, log)
+            process_batch(b2c_pipeline, b2b_pipeline, events, pg_pool, log, concurrency=settings.worker_concurrency, executor=executor)
     finally:
+        if executor is not None:
+            executor.shutdown()
+        listen_conn.close()
         neo4j.close()
         pg_pool.close()
 